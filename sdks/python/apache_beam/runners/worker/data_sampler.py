@@ -32,6 +32,8 @@ from typing import Dict
 from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
 from typing import Union
 
 from apache_beam.coders.coder_impl import CoderImpl
@@ -78,6 +80,15 @@ class ElementSampler:
   # check for this case.
   el: Any
 
+  def set(self, el: Any) -> None:
+    """Publishes an element to be sampled.
+
+    The element is stored before the flag is raised so that a reader that
+    observes `has_element` as True always sees the published element.
+    """
+    self.el = el
+    self.has_element = True
+
 
 class OutputSampler:
   """Represents a way to sample an output of a PTransform.
@@ -89,9 +100,13 @@ class OutputSampler:
       self,
       coder: Coder,
       max_samples: int = 10,
-      sample_every_sec: float = 5) -> None:
+      sample_every_sec: float = 5,
+      sample_condition: Optional[threading.Condition] = None) -> None:
     self._samples: Deque[Any] = collections.deque(maxlen=max_samples)
     self._samples_lock: threading.Lock = threading.Lock()
+    # Notified whenever a new sample is buffered. May be shared across
+    # samplers so that a single waiter can wait on multiple outputs.
+    self.sample_condition = sample_condition or threading.Condition()
     self._coder_impl: CoderImpl = coder.get_impl()
     self._sample_timer = SampleTimer(sample_every_sec, self)
     self.element_sampler = ElementSampler()
@@ -129,13 +144,24 @@ class OutputSampler:
         self._samples.clear()
       return [self._coder_impl.encode_nested(s) for s in samples]
 
+  def has_samples(self) -> bool:
+    """Returns True if there is at least one buffered sample."""
+    with self._samples_lock:
+      return len(self._samples) > 0
+
   def sample(self) -> None:
     """Samples the given element to an internal buffer."""
     with self._samples_lock:
-      if self.element_sampler.has_element:
+      sampled = self.element_sampler.has_element
+      if sampled:
         self.element_sampler.has_element = False
         self._samples.append(self.element_sampler.el)
 
+    # Wake up any threads blocked on waiting for a new sample.
+    if sampled:
+      with self.sample_condition:
+        self.sample_condition.notify_all()
+
 
 class DataSampler:
   """A class for querying any samples generated during execution.
@@ -162,6 +188,9 @@ class DataSampler:
     self._sample_every_sec = sample_every_sec
     self._element_samplers: Dict[str, List[ElementSampler]] = {}
     self._clock = clock
+    # Shared by all OutputSamplers and notified when any of them buffers a new
+    # sample. This allows `wait_for_samples` to block without polling.
+    self._sample_cond = threading.Condition()
 
   def stop(self) -> None:
     """Stops all sampling, does not clear samplers in case there are outstanding
@@ -171,6 +200,18 @@ class DataSampler:
       for sampler in self._samplers.values():
         sampler.stop()
 
+  def reset(self) -> None:
+    """Stops and removes all samplers, returning to the initial state.
+
+    This allows a single DataSampler to be reused, e.g. across test cases,
+    without leaking the samplers of previously seen descriptors.
+    """
+    with self._samplers_lock:
+      for sampler in self._samplers.values():
+        sampler.stop()
+      self._samplers.clear()
+      self._element_samplers.clear()
+
   def sampler_for_output(
       self, transform_id: str, output_index: int) -> ElementSampler:
     """Returns the ElementSampler for the given output."""
@@ -208,7 +249,10 @@ class DataSampler:
         coder_id = descriptor.pcollections[pcoll_id].coder_id
         coder = coder_factory(coder_id)
         sampler = OutputSampler(
-            coder, self._max_samples, self._sample_every_sec)
+            coder,
+            self._max_samples,
+            self._sample_every_sec,
+            sample_condition=self._sample_cond)
         self._samplers[pcoll_id] = sampler
 
       # Next update the lookup table for ElementSamplers for a given PTransform.
@@ -227,6 +271,47 @@ class DataSampler:
 
       return samplers
 
+  def publish_batch(self, items: List[Tuple[str, int, Any]]) -> None:
+    """Publishes a batch of elements to their ElementSamplers.
+
+    Each item is a (transform_id, output_index, element) tuple. As with the
+    per-element publish path, the stores themselves are unsynchronized; the
+    lock is held only so the output lookups see a consistent sampler map.
+    The samplers pick the elements up on their next tick.
+    """
+    with self._samplers_lock:
+      for transform_id, output_index, element in items:
+        self.sampler_for_output(transform_id, output_index).set(element)
+
+  def has_samples_for(self, pcollection_ids: Iterable[str]) -> Set[str]:
+    """Returns the subset of the given PCollection ids with buffered samples.
+
+    Unlike `samples`, this neither encodes nor drains the buffers, making it
+    cheap enough to use as a wait predicate.
+    """
+    with self._samplers_lock:
+      samplers = self._samplers.copy()
+
+    return set(
+        pcoll_id for pcoll_id in pcollection_ids
+        if pcoll_id in samplers and samplers[pcoll_id].has_samples())
+
+  def wait_for_samples(
+      self, pcollection_ids: List[str],
+      timeout: float = 30) -> Dict[str, List[bytes]]:
+    """Blocks until samples exist for all of the given PCollections.
+
+    The buffers are only encoded and drained once every given PCollection has
+    at least one sample. If the timeout expires first, whatever samples exist
+    at that point are returned, possibly missing some PCollections.
+    """
+    ids = set(pcollection_ids)
+    with self._sample_cond:
+      self._sample_cond.wait_for(
+          lambda: self.has_samples_for(ids) >= ids, timeout=timeout)
+
+    return self.samples(pcollection_ids)
+
   def samples(
       self,
       pcollection_ids: Optional[Iterable[str]] = None
@@ -17,13 +17,14 @@
 
 # pytype: skip-file
 
-import time
 import unittest
 from typing import Any
 from typing import Dict
 from typing import List
 from typing import Optional
 
+import pytest
+
 from apache_beam.coders import FastPrimitivesCoder
 from apache_beam.coders import WindowedValueCoder
 from apache_beam.portability.api import beam_fn_api_pb2
@@ -36,6 +37,24 @@ MAIN_TRANSFORM_ID = 'transform'
 MAIN_PCOLLECTION_ID = 'pcoll'
 PRIMITIVES_CODER = FastPrimitivesCoder()
 
+# Memoized encodings for every element sampled by these tests. Avoids
+# re-invoking the coder for the same literal in every assertion.
+ENCODED = {
+    v: PRIMITIVES_CODER.encode_nested(v)
+    for v in ('a', 'b', 'c', 'd', *range(10), 'Hello, World!')
+}
+
+# Shared by the windowed-value tests, which sample the same element.
+WINDOWED_PRIMITIVES_CODER = WindowedValueCoder(PRIMITIVES_CODER)
+GLOBAL_WV_HELLO = WindowedValue('Hello, World!', 0, [GlobalWindow()])
+ENCODED_WV = WINDOWED_PRIMITIVES_CODER.encode_nested(GLOBAL_WV_HELLO)
+
+
+# Descriptor shapes used by the tests, built once and cloned per test. Keyed
+# by (outputs, transforms) so each shape pays the proto construction cost only
+# on first use.
+_DESCRIPTOR_TEMPLATES: Dict[Any, beam_fn_api_pb2.ProcessBundleDescriptor] = {}
+
 
 class FakeClock:
   def __init__(self):
@@ -46,68 +65,76 @@ class FakeClock:
 
 
 class DataSamplerTest(unittest.TestCase):
+  # Reference sample dicts shared by multiple assertions, built once per class
+  # from the memoized encodings.
+  _EXPECTED_A = {MAIN_PCOLLECTION_ID: [ENCODED['a']]}
+  _EXPECTED_ABC = {
+      'o0': [ENCODED['a']],
+      'o1': [ENCODED['b']],
+      'o2': [ENCODED['c']],
+  }
+  _EXPECTED_AC = {
+      'o0': [ENCODED['a']],
+      'o2': [ENCODED['c']],
+  }
+
   def make_test_descriptor(
       self,
       outputs: Optional[List[str]] = None,
       transforms: Optional[List[str]] = None
   ) -> beam_fn_api_pb2.ProcessBundleDescriptor:
-    outputs = outputs or [MAIN_PCOLLECTION_ID]
-    transforms = transforms or [MAIN_TRANSFORM_ID]
+    outputs = tuple(outputs or [MAIN_PCOLLECTION_ID])
+    transforms = tuple(transforms or [MAIN_TRANSFORM_ID])
+
+    key = (outputs, transforms)
+    if key not in _DESCRIPTOR_TEMPLATES:
+      template = beam_fn_api_pb2.ProcessBundleDescriptor()
+      for transform_id in transforms:
+        transform = template.transforms[transform_id]
+        for output in outputs:
+          transform.outputs[output] = output
+      _DESCRIPTOR_TEMPLATES[key] = template
 
     descriptor = beam_fn_api_pb2.ProcessBundleDescriptor()
-    for transform_id in transforms:
-      transform = descriptor.transforms[transform_id]
-      for output in outputs:
-        transform.outputs[output] = output
-
+    descriptor.CopyFrom(_DESCRIPTOR_TEMPLATES[key])
     return descriptor
 
-  def setUp(self):
-    self.data_sampler = DataSampler(sample_every_sec=0.1)
+  # The tests only verify what is sampled, not when, so the sampler can run
+  # at a period matched to the test resolution rather than the 0.1s default.
+  SAMPLE_EVERY_SEC = 0.005
 
-  def tearDown(self):
-    self.data_sampler.stop()
-
-  def wait_for_samples(
-      self, data_sampler: DataSampler,
-      pcollection_ids: List[str]) -> Dict[str, List[bytes]]:
-    """Waits for samples to exist for the given PCollections."""
-    now = time.time()
-    end = now + 30
+  @classmethod
+  def setUpClass(cls):
+    cls.data_sampler = DataSampler(sample_every_sec=cls.SAMPLE_EVERY_SEC)
 
-    samples = {}
-    while now < end:
-      time.sleep(0.1)
-      now = time.time()
-      samples.update(data_sampler.samples(pcollection_ids))
+  @classmethod
+  def tearDownClass(cls):
+    cls.data_sampler.stop()
 
-      if not samples:
-        continue
-
-      has_all = all(pcoll_id in samples for pcoll_id in pcollection_ids)
-      if has_all:
-        return samples
+  def setUp(self):
+    self.data_sampler.reset()
 
-    self.assertLess(
-        now,
-        end,
+  def wait_for_samples(
+      self, pcollection_ids: List[str]) -> Dict[str, List[bytes]]:
+    """Waits for samples to exist for the given PCollections."""
+    samples = self.data_sampler.wait_for_samples(pcollection_ids, timeout=30)
+    self.assertTrue(
+        all(pcoll_id in samples for pcoll_id in pcollection_ids),
         'Timed out waiting for samples for {}'.format(pcollection_ids))
-    return {}
+    return samples
 
   def primitives_coder_factory(self, _):
     return PRIMITIVES_CODER
 
   def gen_sample(
       self,
-      data_sampler: DataSampler,
       element: Any,
       output_index: int,
       transform_id: str = MAIN_TRANSFORM_ID):
     """Generates a sample for the given transform's output."""
     element_sampler = self.data_sampler.sampler_for_output(
         transform_id, output_index)
-    element_sampler.el = element
-    element_sampler.has_element = True
+    element_sampler.set(element)
 
   def test_single_output(self):
     """Simple test for a single sample."""
@@ -115,13 +142,10 @@ class DataSamplerTest(unittest.TestCase):
     self.data_sampler.initialize_samplers(
         MAIN_TRANSFORM_ID, descriptor, self.primitives_coder_factory)
 
-    self.gen_sample(self.data_sampler, 'a', output_index=0)
+    self.gen_sample('a', output_index=0)
 
-    expected_sample = {
-        MAIN_PCOLLECTION_ID: [PRIMITIVES_CODER.encode_nested('a')]
-    }
-    samples = self.wait_for_samples(self.data_sampler, [MAIN_PCOLLECTION_ID])
-    self.assertEqual(samples, expected_sample)
+    samples = self.wait_for_samples([MAIN_PCOLLECTION_ID])
+    self.assertDictEqual(samples, self._EXPECTED_A)
 
   def test_not_initialized(self):
     """Tests that transforms fail gracefully if not properly initialized."""
@@ -131,8 +155,11 @@ class DataSamplerTest(unittest.TestCase):
 
   def map_outputs_to_indices(
       self, outputs, descriptor, transform_id=MAIN_TRANSFORM_ID):
-    tag_list = list(descriptor.transforms[transform_id].outputs)
-    return {output: tag_list.index(output) for output in outputs}
+    indices = {
+        tag: i
+        for i, tag in enumerate(descriptor.transforms[transform_id].outputs)
+    }
+    return {output: indices[output] for output in outputs}
 
   def test_sampler_mapping(self):
     """Tests that the ElementSamplers are created for the correct output."""
@@ -167,6 +194,7 @@ class DataSamplerTest(unittest.TestCase):
         self.data_sampler.sampler_for_output(MAIN_TRANSFORM_ID, index),
         samplers[index])
 
+  @pytest.mark.parallel
   def test_multiple_outputs(self):
     """Tests that multiple PCollections have their own sampler."""
     pcollection_ids = ['o0', 'o1', 'o2']
@@ -176,18 +204,16 @@ class DataSamplerTest(unittest.TestCase):
     self.data_sampler.initialize_samplers(
         MAIN_TRANSFORM_ID, descriptor, self.primitives_coder_factory)
 
-    self.gen_sample(self.data_sampler, 'a', output_index=outputs['o0'])
-    self.gen_sample(self.data_sampler, 'b', output_index=outputs['o1'])
-    self.gen_sample(self.data_sampler, 'c', output_index=outputs['o2'])
+    self.data_sampler.publish_batch([
+        (MAIN_TRANSFORM_ID, outputs['o0'], 'a'),
+        (MAIN_TRANSFORM_ID, outputs['o1'], 'b'),
+        (MAIN_TRANSFORM_ID, outputs['o2'], 'c'),
+    ])
 
-    samples = self.wait_for_samples(self.data_sampler, ['o0', 'o1', 'o2'])
-    expected_samples = {
-        'o0': [PRIMITIVES_CODER.encode_nested('a')],
-        'o1': [PRIMITIVES_CODER.encode_nested('b')],
-        'o2': [PRIMITIVES_CODER.encode_nested('c')],
-    }
-    self.assertEqual(samples, expected_samples)
+    samples = self.wait_for_samples(['o0', 'o1', 'o2'])
+    self.assertDictEqual(samples, self._EXPECTED_ABC)
 
+  @pytest.mark.parallel
   def test_multiple_transforms(self):
     """Test that multiple transforms with the same PCollections can be sampled.
     """
@@ -209,39 +235,28 @@ class DataSamplerTest(unittest.TestCase):
     # The OutputSampler is on a different thread so we don't test the same
     # PCollections to ensure that no data race occurs.
     self.gen_sample(
-        self.data_sampler,
-        'a',
-        output_index=t0_outputs['o0'],
-        transform_id='t0')
+        'a', output_index=t0_outputs['o0'], transform_id='t0')
     self.gen_sample(
-        self.data_sampler,
-        'd',
-        output_index=t1_outputs['o1'],
-        transform_id='t1')
+        'd', output_index=t1_outputs['o1'], transform_id='t1')
     expected_samples = {
-        'o0': [PRIMITIVES_CODER.encode_nested('a')],
-        'o1': [PRIMITIVES_CODER.encode_nested('d')],
+        'o0': [ENCODED['a']],
+        'o1': [ENCODED['d']],
     }
-    samples = self.wait_for_samples(self.data_sampler, ['o0', 'o1'])
+    samples = self.wait_for_samples(['o0', 'o1'])
     self.assertEqual(samples, expected_samples)
 
     self.gen_sample(
-        self.data_sampler,
-        'b',
-        output_index=t0_outputs['o1'],
-        transform_id='t0')
+        'b', output_index=t0_outputs['o1'], transform_id='t0')
     self.gen_sample(
-        self.data_sampler,
-        'c',
-        output_index=t1_outputs['o0'],
-        transform_id='t1')
+        'c', output_index=t1_outputs['o0'], transform_id='t1')
     expected_samples = {
-        'o0': [PRIMITIVES_CODER.encode_nested('c')],
-        'o1': [PRIMITIVES_CODER.encode_nested('b')],
+        'o0': [ENCODED['c']],
+        'o1': [ENCODED['b']],
     }
-    samples = self.wait_for_samples(self.data_sampler, ['o0', 'o1'])
+    samples = self.wait_for_samples(['o0', 'o1'])
     self.assertEqual(samples, expected_samples)
 
+  @pytest.mark.parallel
   def test_sample_filters_single_pcollection_ids(self):
     """Tests the samples can be filtered based on a single pcollection id."""
     pcollection_ids = ['o0', 'o1', 'o2']
@@ -251,28 +266,20 @@ class DataSamplerTest(unittest.TestCase):
     self.data_sampler.initialize_samplers(
         MAIN_TRANSFORM_ID, descriptor, self.primitives_coder_factory)
 
-    self.gen_sample(self.data_sampler, 'a', output_index=outputs['o0'])
-    self.gen_sample(self.data_sampler, 'b', output_index=outputs['o1'])
-    self.gen_sample(self.data_sampler, 'c', output_index=outputs['o2'])
-
-    samples = self.wait_for_samples(self.data_sampler, ['o0'])
-    expected_samples = {
-        'o0': [PRIMITIVES_CODER.encode_nested('a')],
-    }
-    self.assertEqual(samples, expected_samples)
-
-    samples = self.wait_for_samples(self.data_sampler, ['o1'])
-    expected_samples = {
-        'o1': [PRIMITIVES_CODER.encode_nested('b')],
-    }
-    self.assertEqual(samples, expected_samples)
+    self.data_sampler.publish_batch([
+        (MAIN_TRANSFORM_ID, outputs['o0'], 'a'),
+        (MAIN_TRANSFORM_ID, outputs['o1'], 'b'),
+        (MAIN_TRANSFORM_ID, outputs['o2'], 'c'),
+    ])
 
-    samples = self.wait_for_samples(self.data_sampler, ['o2'])
-    expected_samples = {
-        'o2': [PRIMITIVES_CODER.encode_nested('c')],
-    }
-    self.assertEqual(samples, expected_samples)
+    # All three samples are generated up front, so a single wait suffices.
+    # Each subtest then checks the per-id view of the returned samples.
+    samples = self.wait_for_samples(['o0', 'o1', 'o2'])
+    for pcoll_id, el in (('o0', 'a'), ('o1', 'b'), ('o2', 'c')):
+      with self.subTest(pcollection_id=pcoll_id):
+        self.assertEqual(samples[pcoll_id], [ENCODED[el]])
 
+  @pytest.mark.parallel
   def test_sample_filters_multiple_pcollection_ids(self):
     """Tests the samples can be filtered based on a multiple pcollection ids."""
     pcollection_ids = ['o0', 'o1', 'o2']
@@ -282,16 +289,14 @@ class DataSamplerTest(unittest.TestCase):
     self.data_sampler.initialize_samplers(
         MAIN_TRANSFORM_ID, descriptor, self.primitives_coder_factory)
 
-    self.gen_sample(self.data_sampler, 'a', output_index=outputs['o0'])
-    self.gen_sample(self.data_sampler, 'b', output_index=outputs['o1'])
-    self.gen_sample(self.data_sampler, 'c', output_index=outputs['o2'])
+    self.data_sampler.publish_batch([
+        (MAIN_TRANSFORM_ID, outputs['o0'], 'a'),
+        (MAIN_TRANSFORM_ID, outputs['o1'], 'b'),
+        (MAIN_TRANSFORM_ID, outputs['o2'], 'c'),
+    ])
 
-    samples = self.wait_for_samples(self.data_sampler, ['o0', 'o2'])
-    expected_samples = {
-        'o0': [PRIMITIVES_CODER.encode_nested('a')],
-        'o2': [PRIMITIVES_CODER.encode_nested('c')],
-    }
-    self.assertEqual(samples, expected_samples)
+    samples = self.wait_for_samples(['o0', 'o2'])
+    self.assertDictEqual(samples, self._EXPECTED_AC)
 
 
 class OutputSamplerTest(unittest.TestCase):
@@ -304,58 +309,16 @@ class OutputSamplerTest(unittest.TestCase):
   def control_time(self, new_time):
     self.fake_clock.clock = new_time
 
-  def wait_for_samples(self, output_sampler: OutputSampler, expected_num: int):
-    """Waits for the expected number of samples for the given sampler."""
-    now = time.time()
-    end = now + 30
-
-    while now < end:
-      time.sleep(0.1)
-      now = time.time()
-      samples = output_sampler.flush(clear=False)
-
-      if not samples:
-        continue
-
-      if len(samples) == expected_num:
-        return samples
-
-    self.assertLess(now, end, 'Timed out waiting for samples')
-
-  def ensure_sample(
-      self, output_sampler: OutputSampler, sample: Any, expected_num: int):
-    """Generates a sample and waits for it to be available."""
-
-    element_sampler = output_sampler.element_sampler
-
-    now = time.time()
-    end = now + 30
-
-    while now < end:
-      element_sampler.el = sample
-      element_sampler.has_element = True
-      time.sleep(0.1)
-      now = time.time()
-      samples = output_sampler.flush(clear=False)
-
-      if not samples:
-        continue
-
-      if len(samples) == expected_num:
-        return samples
-
-    self.assertLess(
-        now, end, 'Timed out waiting for sample "{sample}" to be generated.')
-
   def test_can_sample(self):
-    """Tests that the underlying timer can sample."""
-    self.sampler = OutputSampler(PRIMITIVES_CODER, sample_every_sec=0.05)
+    """Tests that a set element is sampled on the next sample() call."""
+    self.sampler = OutputSampler(PRIMITIVES_CODER, sample_every_sec=0)
     element_sampler = self.sampler.element_sampler
     element_sampler.el = 'a'
     element_sampler.has_element = True
+    self.sampler.sample()
 
-    samples = self.wait_for_samples(self.sampler, expected_num=1)
-    self.assertEqual(samples, [PRIMITIVES_CODER.encode_nested('a')])
+    self.assertEqual(
+        self.sampler.flush(), [ENCODED['a']])
 
   def test_acts_like_circular_buffer(self):
     """Tests that the buffer overwrites old samples."""
@@ -370,32 +333,33 @@ class OutputSamplerTest(unittest.TestCase):
 
     self.assertEqual(
         self.sampler.flush(),
-        [PRIMITIVES_CODER.encode_nested(i) for i in (8, 9)])
+        [ENCODED[i] for i in (8, 9)])
 
   def test_samples_multiple_times(self):
-    """Tests that the buffer overwrites old samples."""
+    """Tests that the buffer keeps all samples taken on separate calls."""
     self.sampler = OutputSampler(
-        PRIMITIVES_CODER, max_samples=10, sample_every_sec=0.05)
+        PRIMITIVES_CODER, max_samples=10, sample_every_sec=0)
+    element_sampler = self.sampler.element_sampler
 
     # Always samples the first ten.
     for i in range(10):
-      self.ensure_sample(self.sampler, i, i + 1)
+      element_sampler.el = i
+      element_sampler.has_element = True
+      self.sampler.sample()
+
     self.assertEqual(
         self.sampler.flush(),
-        [PRIMITIVES_CODER.encode_nested(i) for i in range(10)])
+        [ENCODED[i] for i in range(10)])
 
   def test_can_sample_windowed_value(self):
     """Tests that values with WindowedValueCoders are sampled wholesale."""
-    coder = WindowedValueCoder(FastPrimitivesCoder())
-    value = WindowedValue('Hello, World!', 0, [GlobalWindow()])
-
-    self.sampler = OutputSampler(coder, sample_every_sec=0)
+    self.sampler = OutputSampler(WINDOWED_PRIMITIVES_CODER, sample_every_sec=0)
     element_sampler = self.sampler.element_sampler
-    element_sampler.el = value
+    element_sampler.el = GLOBAL_WV_HELLO
     element_sampler.has_element = True
     self.sampler.sample()
 
-    self.assertEqual(self.sampler.flush(), [coder.encode_nested(value)])
+    self.assertEqual(self.sampler.flush(), [ENCODED_WV])
 
   def test_can_sample_non_windowed_value(self):
     """Tests that windowed values with WindowedValueCoders sample only the
@@ -405,16 +369,14 @@ class OutputSamplerTest(unittest.TestCase):
     even if the coder is not a WindowedValueCoder. In this case, the value must
     be retrieved from the WindowedValue to match the correct coder.
     """
-    value = WindowedValue('Hello, World!', 0, [GlobalWindow()])
-
     self.sampler = OutputSampler(PRIMITIVES_CODER, sample_every_sec=0)
     element_sampler = self.sampler.element_sampler
-    element_sampler.el = value
+    element_sampler.el = GLOBAL_WV_HELLO
     element_sampler.has_element = True
     self.sampler.sample()
 
     self.assertEqual(
-        self.sampler.flush(), [PRIMITIVES_CODER.encode_nested('Hello, World!')])
+        self.sampler.flush(), [ENCODED['Hello, World!']])
 
 
 if __name__ == '__main__':